@@ -15,8 +15,9 @@ import os
 import json
 import glob
 import argparse
-from tqdm       import tqdm
-from utils      import keep_letters, cal_micro
+from tqdm        import tqdm
+from collections import deque
+from utils       import keep_letters, cal_micro
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--output_folder',  type=str, default="results")
@@ -27,11 +28,11 @@ pred_files = glob.glob(args.output_folder + "/*.json")
 
 crawler_recalls, precisions, recalls, recalls_100, recalls_50, recalls_20, actions, scores = [], [], [], [], [], [], [], []
 for pred_file in tqdm(pred_files):
-    paper_root = json.load(open(pred_file))
-    crawled_papers, crawled_paper_set, selected_paper_set, queue, action, score = [], set(), set(), [paper_root], 0, []
+    paper_root = json.load(open(pred_file, encoding="utf-8"))
+    crawled_papers, crawled_paper_set, selected_paper_set, queue, action, score = [], set(), set(), deque([paper_root]), 0, []
     answer_paper_set = set([keep_letters(paper) for paper in paper_root["extra"]["answer"]])
     while len(queue) > 0:
-        node, queue = queue[0], queue[1:]
+        node = queue.popleft()
         action += len(node["child"])
         total_score = 0
         for _, v in node["child"].items():
@@ -50,10 +51,10 @@ for pred_file in tqdm(pred_files):
     
     # ensemble
     if args.output_folder_ensemble is not None:
-        paper_root = json.load(open(os.path.join(args.output_folder_ensemble, pred_file.split("/")[-1])))
-        queue = [paper_root]
+        paper_root = json.load(open(os.path.join(args.output_folder_ensemble, pred_file.split("/")[-1]), encoding="utf-8"))
+        queue = deque([paper_root])
         while len(queue) > 0:
-            node, queue = queue[0], queue[1:]
+            node = queue.popleft()
             for _, v in node["child"].items():
                 for i in v:
                     queue.append(i)
@@ -11,7 +11,11 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-from transformers import AutoModelForCausalLM, AutoTokenizer
+import math
+import requests
+from transformers        import AutoModelForCausalLM, AutoTokenizer
+from urllib3.util.retry  import Retry
+from requests.adapters   import HTTPAdapter
 
 class Agent:
     """
@@ -41,36 +45,40 @@ class Agent:
             padding_side='left'
         )
     
-    def infer_score(self, prompts):
+    def infer_score(self, prompts, batch_size=16):
         """
         对提示进行评分推理
         
         参数:
             prompts: 提示列表
+            batch_size: 批处理大小
             
         返回:
             评分列表，表示每个提示的相关性得分
         """
         if len(prompts) == 0:
             return []
-        # 对提示进行编码
-        encoded_input = self.tokenizer(prompts, return_tensors='pt', padding=True, truncation=True)
-        input_ids = encoded_input.input_ids.cuda(self.model.device)
-        attention_mask = encoded_input.attention_mask.cuda(self.model.device)
-
-        # 生成输出并获取评分
-        outputs = self.model.generate(
-            input_ids=input_ids,
-            attention_mask=attention_mask,
-            max_new_tokens=1,
-            output_scores=True, 
-            return_dict_in_generate=True, 
-            do_sample=False
-        )
         # 获取"True"标记的ID
         true_token_id = self.tokenizer.convert_tokens_to_ids('True')
-        # 计算"True"标记的概率作为评分
-        probs = outputs.scores[0].softmax(dim=-1)[:, true_token_id].cpu().numpy().tolist()
+        probs = []
+        # 分批处理提示，避免整层论文一次性填充到同一个批次中导致显存溢出
+        for i in range(0, len(prompts), batch_size):
+            # 对当前批次进行编码
+            encoded_input = self.tokenizer(prompts[i: i + batch_size], return_tensors='pt', padding=True, truncation=True)
+            input_ids = encoded_input.input_ids.cuda(self.model.device)
+            attention_mask = encoded_input.attention_mask.cuda(self.model.device)
+
+            # 生成输出并获取评分
+            outputs = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=1,
+                output_scores=True, 
+                return_dict_in_generate=True, 
+                do_sample=False
+            )
+            # 计算"True"标记的概率作为评分
+            probs += outputs.scores[0].softmax(dim=-1)[:, true_token_id].cpu().numpy().tolist()
         return probs
 
     def infer(self, prompt, sample=False):
@@ -163,7 +171,120 @@ class Agent:
             for response in self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True):
                 responses.append(response)
         return responses
+
+class RemoteAgent:
+    """
+    RemoteAgent类通过vLLM的OpenAI兼容接口调用语言模型，接口与Agent一致
     
+    模型权重只在vLLM服务中加载一次，多个进程可以共享同一个服务，例如:
+        vllm serve checkpoints/pasa-7b-selector --port 8001
+    """
+    def __init__(self, model_name, base_url, timeout=600, max_model_len=None):
+        """
+        初始化RemoteAgent
+        
+        参数:
+            model_name: 预训练模型的名称或路径，需与vLLM服务的模型名一致
+            base_url: vLLM服务地址，例如 http://localhost:8001
+            timeout: 单个批次请求的超时时间（秒）
+            max_model_len: 服务端的最大上下文长度，需与vLLM的--max-model-len一致，默认使用分词器的model_max_length
+        """
+        self.model_name = model_name
+        self.base_url   = base_url.rstrip("/")
+        self.timeout    = timeout
+        self.session    = requests.Session()
+        # 服务端过载或重启时重试，completions请求没有副作用，POST也可以安全重试
+        self.session.mount(self.base_url, HTTPAdapter(max_retries=Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=None)))
+        # 只加载分词器，用于在本地应用与Agent相同的聊天模板
+        self.tokenizer  = AutoTokenizer.from_pretrained(model_name)
+        self.max_model_len = max_model_len or self.tokenizer.model_max_length
+
+    def complete(self, prompts, batch_size, **params):
+        """
+        调用vLLM的completions接口，每个请求提交一个批次的提示，由服务端批处理
+        
+        与Agent一样在本地用分词器截断提示，并为生成的标记留出空间，超长的摘要或章节列表不会导致服务端拒绝整个批次
+        
+        参数:
+            prompts: 提示列表
+            batch_size: 每个请求包含的提示数量
+            params: 采样参数，需包含max_tokens
+            
+        返回:
+            与提示顺序一致的choices列表
+        """
+        choices = []
+        for i in range(0, len(prompts), batch_size):
+            # 以标记ID提交截断后的提示
+            input_ids = self.tokenizer(prompts[i: i + batch_size], truncation=True, max_length=self.max_model_len - params["max_tokens"]).input_ids
+            response = self.session.post(
+                f"{self.base_url}/v1/completions",
+                json={"model": self.model_name, "prompt": input_ids, **params},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            choices += sorted(response.json()["choices"], key=lambda choice: choice["index"])
+        return choices
+
+    def infer_score(self, prompts, batch_size=16):
+        """
+        对提示进行评分推理
+        
+        参数:
+            prompts: 提示列表
+            batch_size: 每个请求包含的提示数量
+            
+        返回:
+            评分列表，表示每个提示的相关性得分
+        """
+        if len(prompts) == 0:
+            return []
+        # 只生成一个标记，并返回概率最高的若干个候选标记的对数概率
+        choices = self.complete(prompts, batch_size, max_tokens=1, temperature=0, logprobs=20)
+        # "True"标记的概率作为评分，不在候选中时其概率已远低于0.5，记为0
+        return [math.exp(choice["logprobs"]["top_logprobs"][0].get("True", -math.inf)) for choice in choices]
+
+    def infer(self, prompt, sample=False):
+        """
+        对单个提示进行推理
+        
+        参数:
+            prompt: 提示文本
+            sample: 是否使用采样生成
+            
+        返回:
+            生成的文本
+        """
+        return self.batch_infer([prompt], sample=sample)[0]
+
+    def batch_infer(self, prompts, batch_size=8, sample=False):
+        """
+        批量推理多个提示
+        
+        参数:
+            prompts: 提示列表
+            batch_size: 每个请求包含的提示数量
+            sample: 是否使用采样生成
+            
+        返回:
+            生成的文本列表
+        """
+        if len(prompts) == 0:
+            return []
+        # 对所有提示应用聊天模板
+        texts = [self.tokenizer.apply_chat_template(
+            [{
+                "content": prompt.strip(),
+                "role":    "user"
+            }],
+            tokenize=False,
+            add_generation_prompt=True
+        ) for prompt in prompts]
+        # 设置采样参数
+        params = {"temperature": 2.0, "top_p": 0.8} if sample else {"temperature": 0}
+        choices = self.complete(texts, batch_size, max_tokens=512, **params)
+        return [choice["text"] for choice in choices]
+
 if __name__ == "__main__":
     selector = Agent("/mnt/hdfs/foundation/agent/heyc/checkpoints/pasa-7b-selector")
     promtp = "You are an elite researcher in the field of AI, conducting research on Give me papers which shows that using a smaller dataset in large language model pre-training can result in better models than using bigger datasets.\n. Evaluate whether the following paper fully satisfies the detailed requirements of the user query and provide your reasoning. Ensure that your decision and reasoning are consistent.\n\nSearched Paper:\nTitle: Specialized Language Models with Cheap Inference from Limited Domain Data\nAbstract:  Abstract Large language models have emerged as a versatile tool but are challenging to apply to tasks lacking large inference budgets and large in-domain training sets. This work formalizes these constraints and distinguishes four important variables: the pretraining budget (for training before the target domain is known), the specialization budget (for training after the target domain is known), the inference budget, and the in-domain training set size. Across these settings, we compare different approaches from the machine learning literature. Limited by inference cost, we find better alternatives to the standard practice of training very large vanilla transformer models. In particular, we show that hyper-networks and mixture of experts have better perplexity for large pretraining budgets, while small models trained on importance sampled datasets are attractive for large specialization budgets. \n\nUser Query: Give me papers which shows that using a smaller dataset in large language model pre-training can result in better models than using bigger datasets.\n\n\nOutput format: Decision: True/False\nReason:... \nDecision:"
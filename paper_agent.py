@@ -12,18 +12,46 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import re
+import sys
 import json
+import heapq
+import functools
+import warnings
+import itertools
 import threading
-from paper_node import PaperNode
-from models     import Agent
-from datetime   import datetime
-from utils      import (
+from paper_node         import PaperNode
+from models             import Agent
+from datetime           import datetime
+from concurrent.futures import ThreadPoolExecutor
+from utils              import (
+    cite_pattern,
+    personalized_pagerank,
     search_paper_by_title,
     google_search_arxiv_id,
     search_paper_by_arxiv_id,
     search_section_by_arxiv_id
 )
 
+def isolate_failure(default):
+    """
+    线程池中单个任务出错时只发出警告并返回default，不影响同一批的其他任务
+    
+    Executor.map会在主线程中重新抛出第一个任务异常，不隔离时一个解析失败的页面就会中断整个查询
+    
+    参数:
+        default: 出错时的返回值
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                warnings.warn(f"{func.__name__} failed: {e!r}")
+                return default
+        return wrapper
+    return decorator
+
 class PaperAgent:
     """
     PaperAgent类实现了一个智能论文搜索和扩展代理
@@ -53,6 +81,9 @@ class PaperAgent:
         search_papers:  int = 10, # per query
         expand_papers:  int = 20, # per layer
         threads_num:    int = 20, # number of threads in parallel at the same time
+        max_total_papers: int = None, # total papers per user query, None for no limit
+        prefilter_threshold: float = None, # cosine similarity threshold of the embedding pre-filter, None to disable
+        prefilter_model: str = "BAAI/bge-small-en-v1.5",
     ) -> None:
         """
         初始化PaperAgent
@@ -67,22 +98,27 @@ class PaperAgent:
             search_queries: 每个用户查询生成的搜索关键词数量
             search_papers: 每个搜索关键词返回的论文数量
             expand_papers: 每层扩展时处理的论文数量
-            threads_num: 并行处理的线程数
+            threads_num: 线程池的最大线程数
+            max_total_papers: 每个用户查询最多处理的论文总数，达到后停止搜索和扩展，None表示不限制
+            prefilter_threshold: 向量预筛选的余弦相似度阈值，低于阈值的论文不交给选择器模型，None表示不预筛选
+            prefilter_model: 向量预筛选使用的fastembed模型名称
         """
         self.user_query = user_query
         self.crawler    = crawler
         self.selector   = selector
         self.end_date   = end_date
-        self.prompts    = json.load(open(prompts_path))
+        self.prompts    = PaperAgent.load_prompts(prompts_path)
+        # 预先填入用户查询（转义其中的花括号），评估每篇论文时只需填入标题和摘要
+        self.select_template = self.prompts["get_selected"].replace("{user_query}", user_query.replace("{", "{{").replace("}", "}}"))
         # 创建根节点，存储用户查询
-        self.root       = PaperNode({
-            "title": user_query,
-            "extra": {
+        self.root       = PaperNode(
+            title = user_query,
+            extra = {
                 "touch_ids": [],           # 已处理过的论文ID列表
-                "crawler_recall_papers": [], # 所有爬取到的论文标题
-                "recall_papers": [],         # 相关性评分大于0.5的论文标题
+                "crawler_recall_papers": [], # 所有爬取到的论文标题，不重复
+                "recall_papers": [],         # 相关性评分大于0.5的论文标题，不重复
             }
-        })
+        )
 
         # 超参数设置
         self.expand_layers   = expand_layers
@@ -90,191 +126,272 @@ class PaperAgent:
         self.search_papers   = search_papers
         self.expand_papers   = expand_papers
         self.threads_num     = threads_num
+        self.max_total_papers = max_total_papers
+        self.ppr_alpha       = 0.15  # Personalized PageRank的随机跳转概率
+        self.ppr_iterations  = 20    # Personalized PageRank的迭代次数
         self.papers_queue    = []  # 待扩展的论文队列
+        self.citations       = set()  # 已发现的引用关系 (引用论文arXiv ID, 被引论文arXiv ID)
         self.expand_start    = 0   # 当前扩展层在队列中的起始位置
-        self.lock            = threading.Lock()  # 线程锁，用于保护共享资源
-        # 正则表达式模板，用于提取引用、搜索和扩展内容
+        self.touch_ids       = set()  # 已处理过的论文ID集合，用于O(1)去重，root.extra["touch_ids"]仅用于序列化
+        self.crawled_titles  = set()  # crawler_recall_papers中已有的标题
+        self.recalled_titles = set()  # recall_papers中已有的标题
+        self.lock            = threading.Lock()  # 线程锁，仅保护touch_ids的检查与插入，其余结果均在主线程中合并
+        self.pool            = ThreadPoolExecutor(max_workers=threads_num)  # 线程池，所有并行任务共用
+        # 向量预筛选，用于在调用选择器模型前过滤明显无关的论文
+        self.prefilter_threshold = prefilter_threshold
+        self.embedder        = None
+        if prefilter_threshold is not None:
+            self.embedder        = PaperAgent.load_embedder(prefilter_model)
+            self.query_embedding = next(iter(self.embedder.query_embed(user_query)))
+        # 正则表达式模板，用于提取引用、搜索和扩展内容，初始化时一次性编译
         self.templates       = {
-            "cite_template":   r"~\\cite\{(.*?)\}",  # 提取引用
-            "search_template": r"Search\](.*?)\[",   # 提取搜索查询
-            "expand_template": r"Expand\](.*?)\["    # 提取扩展内容
+            "cite_template":   cite_pattern,                                  # 提取引用，优先使用RE2引擎
+            "search_template": re.compile(r"Search\](.*?)\[", re.DOTALL),   # 提取搜索查询
+            "expand_template": re.compile(r"Expand\](.*?)\[", re.DOTALL)    # 提取扩展内容
         }
     
     @staticmethod
-    def do_parallel(func, args, num):
+    @functools.lru_cache(maxsize=4)
+    def load_prompts(prompts_path):
+        """
+        读取提示模板文件，同一路径只读取一次，所有PaperAgent实例共享
+        
+        参数:
+            prompts_path: 提示模板文件路径
+        """
+        with open(prompts_path) as f:
+            return json.load(f)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1)
+    def load_embedder(model_name):
+        """
+        加载向量预筛选使用的fastembed模型，同一模型只加载一次，所有PaperAgent实例共享
+        
+        参数:
+            model_name: fastembed模型名称
+        """
+        from fastembed import TextEmbedding # optional dependency, only needed with prefilter_threshold
+        return TextEmbedding(model_name)
+
+    def score_papers(self, papers):
+        """
+        使用选择器模型评估论文相关性
+        
+        设置了prefilter_threshold时，先计算论文与用户查询的向量余弦相似度，
+        摘要为空或相似度低于阈值的论文直接记为0分，不再交给选择器模型
+        
+        参数:
+            papers: (标题, 摘要) 列表
+            
+        返回:
+            与papers顺序一致的相关性评分列表
+        """
+        scores, candidates = [0.0] * len(papers), list(range(len(papers)))
+        if self.embedder is not None:
+            candidates = [i for i in candidates if papers[i][1].strip()]
+            embeddings = self.embedder.passage_embed([papers[i][0] + "\n" + papers[i][1] for i in candidates])
+            query = self.query_embedding
+            candidates = [
+                i for i, embedding in zip(candidates, embeddings)
+                if float(embedding @ query) / float((embedding @ embedding) * (query @ query)) ** 0.5 >= self.prefilter_threshold
+            ]
+        select_prompts = [self.select_template.format_map({"title": papers[i][0], "abstract": papers[i][1]}) for i in candidates]
+        for i, score in zip(candidates, self.selector.infer_score(select_prompts)):
+            scores[i] = score
+        return scores
+
+    def record_paper(self, title, score):
+        """
+        将论文标题记录到root.extra的召回列表中，相同标题只记录一次
+        
+        参数:
+            title: 论文标题
+            score: 选择器模型给出的相关性评分
+            
+        返回:
+            驻留后的标题，同一标题在论文节点和召回列表中共享同一个字符串对象
+        """
+        title = sys.intern(title)
+        if title not in self.crawled_titles:
+            self.crawled_titles.add(title)
+            self.root.extra["crawler_recall_papers"].append(title)
+        # 相关性评分大于0.5的论文被认为是相关的
+        if score > 0.5 and title not in self.recalled_titles:
+            self.recalled_titles.add(title)
+            self.root.extra["recall_papers"].append(title)
+        return title
+
+    def budget_exhausted(self):
+        """
+        判断已处理的论文数是否达到max_total_papers上限
+        """
+        return self.max_total_papers is not None and len(self.touch_ids) >= self.max_total_papers
+
+    def touch(self, arxiv_id):
         """
-        并行执行函数
+        将论文标记为已处理
         
         参数:
-            func: 要执行的函数
-            args: 函数参数
-            num: 并行线程数
-        """
-        threads = []
-        for _ in range(num):
-            thread = threading.Thread(target=func, args=args)
-            thread.start()
-            threads.append(thread)
-        for thread in threads:
-            thread.join()
+            arxiv_id: 论文的arXiv ID
+            
+        返回:
+            该论文是否为首次处理，达到论文总数上限后始终返回False
+        """
+        # 锁只覆盖集合的检查与插入，避免多个线程重复获取同一篇论文
+        with self.lock:
+            if arxiv_id in self.touch_ids or self.budget_exhausted():
+                return False
+            self.touch_ids.add(arxiv_id)
+        self.root.extra["touch_ids"].append(arxiv_id)
+        return True
 
-    def search_paper(self, queries):
+    @isolate_failure(default=[])
+    def search_arxiv_ids(self, query):
         """
-        根据查询列表搜索论文
+        根据单个查询搜索论文的arXiv ID
         
         参数:
-            queries: 搜索查询列表
-        """
-        while queries:
-            # 从查询列表中取出一个查询
-            with self.lock:
-                query, self.root.child[query] = queries.pop(), []
-            # 使用Google搜索API查找相关论文的arXiv ID
-            pre_arxiv_ids, searched_papers = google_search_arxiv_id(query, self.search_papers, self.end_date), []
-            # 处理每个找到的arXiv ID
-            for arxiv_id in pre_arxiv_ids:
-                arxiv_id = arxiv_id.split('v')[0]  # 移除版本号
-                self.lock.acquire()
-                # 检查是否已处理过该论文
-                if arxiv_id not in self.root.extra["touch_ids"]:
-                    self.root.extra["touch_ids"].append(arxiv_id)
-                    self.lock.release()
-                    # 获取论文详细信息
-                    paper = search_paper_by_arxiv_id(arxiv_id)
-                    if paper is not None:
-                        searched_papers.append(paper)
-                else:
-                    self.lock.release()
+            query: 搜索查询
             
-            # 使用选择器模型评估论文相关性
-            select_prompts  = [self.prompts["get_selected"].format(title=paper["title"], abstract=paper["abstract"], user_query=self.user_query) for paper in searched_papers]
-            scores = self.selector.infer_score(select_prompts)
-            # 处理评估结果
-            with self.lock:
-                for score, paper in zip(scores, searched_papers):
-                    self.root.extra["crawler_recall_papers"].append(paper["title"])
-                    # 相关性评分大于0.5的论文被认为是相关的
-                    if score > 0.5:
-                        self.root.extra["recall_papers"].append(paper["title"])
-                    # 创建论文节点
-                    paper_node = PaperNode({
-                        "title":        paper["title"],
-                        "arxiv_id":     paper["arxiv_id"],
-                        "depth":        0,
-                        "abstract" :    paper["abstract"],
-                        "sections" :    paper["sections"],
-                        "source":       "Search " + paper["source"],
-                        "select_score": score,
-                        "extra":        {}
-                    })
-                    # 将论文节点添加到根节点的子节点中
-                    self.root.child[query].append(paper_node)
-                    # 将论文节点添加到待扩展队列中
-                    self.papers_queue.append(paper_node)
+        返回:
+            去除版本号后的arXiv ID列表
+        """
+        # 使用Google搜索API查找相关论文的arXiv ID
+        return [arxiv_id.split('v')[0] for arxiv_id in google_search_arxiv_id(query, self.search_papers, self.end_date)]
+
+    @isolate_failure(default=None)
+    def search_paper(self, arxiv_id):
+        """
+        根据arXiv ID获取单篇论文的详细信息
+        
+        参数:
+            arxiv_id: 论文的arXiv ID
+            
+        返回:
+            论文信息字典，获取失败时返回None
+        """
+        return search_paper_by_arxiv_id(arxiv_id)
 
     def search(self):
         """
         执行搜索阶段
         
         1. 使用爬虫模型生成搜索查询
-        2. 并行执行搜索
+        2. 并行执行所有查询的Google搜索
+        3. 并行获取所有搜索到的论文详细信息
+        4. 一次性评估所有论文的相关性
         """
         # 生成搜索查询
         prompt = self.prompts["generate_query"].format(user_query=self.user_query).strip()
         queries = self.crawler.infer(prompt)
         # 提取搜索查询
-        queries = [q.strip() for q in re.findall(self.templates["search_template"], queries, flags=re.DOTALL)][:self.search_queries]
+        queries = [q.strip() for q in self.templates["search_template"].findall(queries)][:self.search_queries]
         # 并行执行搜索
-        PaperAgent.do_parallel(self.search_paper, (queries,), len(queries))
+        query_arxiv_ids = list(self.pool.map(self.search_arxiv_ids, queries))
+        # 跳过已处理过的论文，每篇论文只归属于第一个搜到它的查询
+        query_sources = []
+        for query, arxiv_ids in zip(queries, query_arxiv_ids):
+            self.root.child[query] = []
+            for arxiv_id in arxiv_ids:
+                # 达到论文总数上限后不再获取任何论文的详细信息
+                if self.budget_exhausted():
+                    break
+                if self.touch(arxiv_id):
+                    query_sources.append((query, arxiv_id))
+        # 所有查询的论文在同一个线程池中并行获取详细信息
+        papers = self.pool.map(self.search_paper, [arxiv_id for _, arxiv_id in query_sources])
+        searched_papers = [(query, paper) for (query, _), paper in zip(query_sources, papers) if paper is not None]
+        
+        # 使用选择器模型评估论文相关性
+        scores = self.score_papers([(paper["title"], paper["abstract"]) for _, paper in searched_papers])
+        # 处理评估结果
+        for score, (query, paper) in zip(scores, searched_papers):
+            title = self.record_paper(paper["title"], score)
+            # 创建论文节点
+            paper_node = PaperNode(
+                title        = title,
+                arxiv_id     = paper["arxiv_id"],
+                depth        = 0,
+                abstract     = paper["abstract"],
+                sections     = paper["sections"],
+                source       = "Search " + paper["source"],
+                select_score = score,
+                extra        = {}
+            )
+            # 将论文节点添加到根节点的子节点中
+            self.root.child[query].append(paper_node)
+            # 将论文节点添加到待扩展队列中
+            self.papers_queue.append(paper_node)
 
-    def get_paper_content(self, new_expand, crawl_prompts, have_full_paper):
+    @isolate_failure(default=None)
+    def get_paper_content(self, paper):
         """
-        获取论文内容并准备扩展
+        获取单篇论文内容并准备扩展
         
         参数:
-            new_expand: 待扩展的论文列表
-            crawl_prompts: 爬虫提示列表
-            have_full_paper: 已获取完整内容的论文列表
-        """
-        while new_expand:
-            # 从待扩展列表中取出一个论文
-            with self.lock:
-                if new_expand:
-                    paper = new_expand.pop(0)
-                else:
-                    break
-            
-            # 如果论文没有章节信息，则获取章节信息
-            if paper.sections == "":
-                paper.sections = search_section_by_arxiv_id(paper.arxiv_id, self.templates["cite_template"])
-                if not paper.sections:
-                    paper.extra["expand"] = "get full paper error"
-                    continue
+            paper: 待扩展的论文
             
-            # 标记论文为未扩展
-            paper.extra["expand"] = "not expand"
-            # 生成选择章节的提示
-            prompt = self.prompts["select_section"].format(user_query=self.user_query, title=paper.title, abstract=paper.abstract, sections=paper.sections.keys()).strip()
-            with self.lock:
-                have_full_paper.append(paper)
-                crawl_prompts.append(prompt)
+        返回:
+            (论文, 选择章节的爬虫提示)，获取失败时返回None
+        """
+        # 如果论文没有章节信息，则获取章节信息
+        if paper.sections == "":
+            paper.sections = search_section_by_arxiv_id(paper.arxiv_id, self.templates["cite_template"])
+            if not paper.sections:
+                paper.extra["expand"] = "get full paper error"
+                return None
+        # 同一篇论文常被多篇论文引用，驻留引用标题使其只保存一份
+        paper.sections = {section: [sys.intern(ref) for ref in refs] for section, refs in paper.sections.items()}
+        
+        # 标记论文为未扩展
+        paper.extra["expand"] = "not expand"
+        # 生成选择章节的提示
+        prompt = self.prompts["select_section"].format(user_query=self.user_query, title=paper.title, abstract=paper.abstract, sections=paper.sections.keys()).strip()
+        return paper, prompt
 
-    def search_ref(self, section_sources_ori, select_prompts, section_sources, lock):
+    @isolate_failure(default=None)
+    def search_ref(self, section_ref):
         """
-        搜索引用论文
+        搜索单篇引用论文
         
         参数:
-            section_sources_ori: 原始章节引用列表
-            select_prompts: 选择器提示列表
-            section_sources: 章节引用列表
-            lock: 线程锁
-        """
-        while section_sources_ori:
-            # 从原始章节引用列表中取出一个引用
-            with lock:
-                if section_sources_ori:
-                    section, title = section_sources_ori.pop(0)
-                else:
-                    break
-            
-            # 根据标题搜索论文
-            searched_paper = search_paper_by_title(title)
-            if searched_paper is None:
-                continue
+            section_ref: (原论文, 章节名称, 引用论文标题)
             
-            # 检查是否已处理过该论文
-            arxiv_id = searched_paper["arxiv_id"]
-            with lock:
-                if arxiv_id not in self.root.extra["touch_ids"]:
-                    self.root.extra["touch_ids"].append(arxiv_id)
-                else:
-                    continue
-            # 生成选择器提示
-            prompt = self.prompts["get_selected"].format(title=title, abstract=searched_paper["abstract"], user_query=self.user_query)
-            with lock:
-                select_prompts.append(prompt)
-                section_sources.append([section, searched_paper])
+        返回:
+            (原论文, 章节名称, 引用论文, 引用论文标题)，未找到或已达论文总数上限时返回None，已处理过时引用论文标题为None
+        """
+        paper, section, title = section_ref
+        # 达到论文总数上限后跳过剩余引用，不再发起标题搜索
+        if self.budget_exhausted():
+            return None
+        # 根据标题搜索论文
+        searched_paper = search_paper_by_title(title)
+        if searched_paper is None:
+            return None
+        
+        # 检查是否已处理过该论文
+        arxiv_id = searched_paper["arxiv_id"]
+        if not self.touch(arxiv_id):
+            return paper, section, searched_paper, None
+        return paper, section, searched_paper, title
 
     def do_expand(self, depth, have_full_paper, crawl_results):
         """
-        执行扩展操作
+        对整层论文执行扩展操作
+        
+        1. 汇总本层所有论文被选中章节中的引用，并行搜索引用论文
+        2. 对本层所有引用论文一次性评估相关性，再分别挂到各自的原论文下
         
         参数:
             depth: 当前扩展深度
             have_full_paper: 已获取完整内容的论文列表
             crawl_results: 爬虫结果列表
         """
-        while have_full_paper:
-            # 从已获取完整内容的论文列表中取出一个论文
-            with self.lock:
-                if have_full_paper:
-                    paper = have_full_paper.pop(0)
-                    crawl_result = crawl_results.pop(0)
-                else:
-                    break
+        section_sources_ori = []
+        for paper, crawl_result in zip(have_full_paper, crawl_results):
             # 提取扩展内容
-            crawl_result = re.findall(self.templates["expand_template"], crawl_result, flags=re.DOTALL)
-            section_sources_ori = []
+            crawl_result = self.templates["expand_template"].findall(crawl_result)
             # 处理每个章节
             for section in crawl_result:
                 section = section.strip()
@@ -282,38 +399,60 @@ class PaperAgent:
                     continue
                 # 处理章节中的引用
                 for ref in paper.sections[section]:
-                    section_sources_ori.append([section, ref])
-            # 并行搜索引用论文
-            select_prompts, section_sources, lock = [], [], threading.Lock()
-            PaperAgent.do_parallel(self.search_ref, (section_sources_ori, select_prompts, section_sources, lock), self.threads_num * 3)
-            # 评估引用论文的相关性
-            scores = self.selector.infer_score(select_prompts)
-            # 处理评估结果
-            for score, (section, ref_paper) in zip(scores, section_sources):
-                self.root.extra["crawler_recall_papers"].append(ref_paper["title"])
-                # 相关性评分大于0.5的论文被认为是相关的
-                if score > 0.5:
-                    self.root.extra["recall_papers"].append(ref_paper["title"])
-                # 创建引用论文节点
-                paper_node = PaperNode({
-                    "title":        ref_paper["title"],
-                    "depth":        depth + 1,
-                    "arxiv_id":     ref_paper["arxiv_id"],
-                    "abstract" :    ref_paper["abstract"],
-                    "sections" :    ref_paper["sections"],
-                    "source":       "Expand " + ref_paper["source"],
-                    "select_score": score,
-                    "extra":        {}
-                })
+                    section_sources_ori.append((paper, section, ref))
+        # 同一篇引用论文可能被本层多篇论文或多个章节引用，按标题去重后只搜索和评估一次
+        title_groups = {}
+        for section_ref in section_sources_ori:
+            title_groups.setdefault(section_ref[2].lower().strip(), []).append(section_ref)
+        title_groups = list(title_groups.values())
+        # 并行搜索引用论文
+        section_sources = []
+        for group, r in zip(title_groups, self.pool.map(self.search_ref, [group[0] for group in title_groups])):
+            if r is None:
+                continue
+            _, _, ref_paper, title = r
+            # 记录所有引用了该论文的引用关系，已处理过的论文不再重复评估
+            for paper, _, _ in group:
+                self.citations.add((paper.arxiv_id, ref_paper["arxiv_id"]))
+            if title is not None:
+                section_sources.append(r)
+        # 评估引用论文的相关性
+        scores = self.score_papers([(title, ref_paper["abstract"]) for _, _, ref_paper, title in section_sources])
+        # 处理评估结果
+        for score, (paper, section, ref_paper, _) in zip(scores, section_sources):
+            title = self.record_paper(ref_paper["title"], score)
+            # 创建引用论文节点
+            paper_node = PaperNode(
+                title        = title,
+                depth        = depth + 1,
+                arxiv_id     = ref_paper["arxiv_id"],
+                abstract     = ref_paper["abstract"],
+                sections     = ref_paper["sections"],
+                source       = "Expand " + ref_paper["source"],
+                select_score = score,
+                extra        = {}
+            )
 
-                # 将引用论文节点添加到原论文的对应章节子节点中
-                with self.lock:
-                    if section not in paper.child:
-                        paper.child[section] = []
-                    paper.child[section].append(paper_node)
-                    paper.extra["expand"] = "success"
-                    # 将引用论文节点添加到待扩展队列中
-                    self.papers_queue.append(paper_node)
+            # 将引用论文节点添加到原论文的对应章节子节点中
+            if section not in paper.child:
+                paper.child[section] = []
+            paper.child[section].append(paper_node)
+            paper.extra["expand"] = "success"
+            # 将引用论文节点添加到待扩展队列中
+            self.papers_queue.append(paper_node)
+
+    def rank_papers(self):
+        """
+        在已发现的引用图上运行Personalized PageRank，为待扩展论文排序
+        
+        以相关性评分大于0.5的论文为种子，按评分分配跳转概率。相比直接按评分排序，
+        被多篇相关论文引用的论文排名更高，而引用大量论文的综述类论文会将权重分散到各个引用上
+        
+        返回:
+            arXiv ID到PageRank值的字典，没有种子论文时为空，此时退化为按相关性评分排序
+        """
+        seeds = {paper.arxiv_id: paper.select_score for paper in self.papers_queue if paper.select_score > 0.5}
+        return personalized_pagerank(self.citations, seeds, self.ppr_alpha, self.ppr_iterations)
 
     def expand(self, depth):
         """
@@ -322,22 +461,25 @@ class PaperAgent:
         参数:
             depth: 当前扩展深度
         """
-        # 对待扩展的论文按相关性评分排序
-        expand_papers = sorted(self.papers_queue[self.expand_start:], key=PaperNode.sort_paper, reverse=True)
-        self.papers_queue = self.papers_queue[:self.expand_start] + expand_papers
-        # 如果不是第一层扩展，则限制扩展论文数量
+        # papers_queue只追加不重建，本层待扩展的论文按下标区间[expand_start, expand_end)读取，不复制列表
+        # 区间的起止在创建islice时就已确定，之后更新expand_start或向队列追加论文都不影响本层的论文
+        expand_end = len(self.papers_queue)
+        expand_papers = itertools.islice(self.papers_queue, self.expand_start, expand_end)
+        # 如果不是第一层扩展，则只取排名最高的expand_papers篇论文；第一层扩展全部论文，无需排序
         if depth > 0:
-            expand_papers = expand_papers[:self.expand_papers]
+            ranks = self.rank_papers()
+            expand_papers = heapq.nlargest(self.expand_papers, expand_papers, key=lambda paper: (ranks.get(paper.arxiv_id, 0.0), paper.select_score))
         # 更新扩展起始位置
-        self.expand_start = len(self.papers_queue)
-        # 准备扩展
-        crawl_prompts, have_full_paper = [], []
+        self.expand_start = expand_end
+        # 达到论文总数上限后不再扩展，避免无用的爬虫推理
+        if self.budget_exhausted():
+            return
         # 并行获取论文内容
-        PaperAgent.do_parallel(self.get_paper_content, (expand_papers, crawl_prompts, have_full_paper), self.threads_num)
+        have_full_paper = [r for r in self.pool.map(self.get_paper_content, expand_papers) if r is not None]
         # 使用爬虫模型提取扩展内容
-        crawl_results = self.crawler.batch_infer(crawl_prompts)
-        # 并行执行扩展
-        PaperAgent.do_parallel(self.do_expand, (depth, have_full_paper, crawl_results), self.threads_num)
+        crawl_results = self.crawler.batch_infer([prompt for _, prompt in have_full_paper])
+        # 执行扩展
+        self.do_expand(depth, [paper for paper, _ in have_full_paper], crawl_results)
 
     def run(self):
         """
@@ -346,8 +488,13 @@ class PaperAgent:
         1. 执行搜索阶段
         2. 执行多轮扩展阶段
         """
-        # 执行搜索阶段
-        self.search()
-        # 执行多轮扩展阶段
-        for depth in range(self.expand_layers):
-            self.expand(depth)
+        try:
+            # 执行搜索阶段
+            self.search()
+            # 执行多轮扩展阶段
+            for depth in range(self.expand_layers):
+                if self.budget_exhausted():
+                    break
+                self.expand(depth)
+        finally:
+            self.pool.shutdown()
@@ -11,6 +11,9 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from dataclasses import dataclass, field
+
+@dataclass(slots=True, eq=False)
 class PaperNode:
     """
     PaperNode类表示论文树中的一个节点
@@ -20,24 +23,31 @@ class PaperNode:
     2. 管理论文的引用关系（子节点）
     3. 提供将节点转换为字典的方法，用于序列化
     4. 提供排序方法，用于按相关性评分排序
+    
+    使用slots存储属性，节点不带__dict__，减少大量节点时的内存占用
     """
-    def __init__(self, attrs):
+    title:        str    = ""                       # 论文标题
+    arxiv_id:     str    = ""                       # arXiv ID
+    depth:        int    = -1                       # 在树中的深度
+    # 子节点，按章节名称组织，每个章节包含多个引用论文节点
+    child:        dict   = field(default_factory=dict)
+    abstract:     str    = ""                       # 论文摘要
+    sections:     object = ""                       # 章节信息，格式为 section name -> list of citation papers
+    source:       str    = "Root"                   # 来源，可以是 Root（根节点）、Search（搜索得到）或 Expand（扩展得到）
+    select_score: float  = 0.0                      # 选择器模型给出的相关性评分
+    extra:        dict   = field(default_factory=dict)  # 额外信息，如扩展状态等
+
+    @classmethod
+    def from_dict(cls, attrs):
         """
-        初始化PaperNode
+        从字典构建节点，子节点递归构建，与todic互为逆操作
         
         参数:
             attrs: 包含论文属性的字典
         """
-        self.title        = attrs.get("title", "")         # 论文标题
-        self.arxiv_id     = attrs.get("arxiv_id", "")     # arXiv ID
-        self.depth        = attrs.get("depth", -1)         # 在树中的深度
-        # 子节点，按章节名称组织，每个章节包含多个引用论文节点
-        self.child        = {k: [PaperNode(i) for i in v] for k, v in attrs.get("child", {}).items()}
-        self.abstract     = attrs.get("abstract", "")      # 论文摘要
-        self.sections     = attrs.get("sections", "")      # 章节信息，格式为 section name -> list of citation papers
-        self.source       = attrs.get("source", "Root")    # 来源，可以是 Root（根节点）、Search（搜索得到）或 Expand（扩展得到）
-        self.select_score = attrs.get("select_score", 0.0) # 选择器模型给出的相关性评分
-        self.extra        = attrs.get("extra", {})         # 额外信息，如扩展状态等
+        attrs = {k: v for k, v in attrs.items() if k in cls.__dataclass_fields__}
+        attrs["child"] = {k: [cls.from_dict(i) for i in v] for k, v in attrs.get("child", {}).items()}
+        return cls(**attrs)
 
     def todic(self):
         """
@@ -69,4 +79,4 @@ class PaperNode:
         返回:
             相关性评分，用于排序
         """
-        return item.select_score
\ No newline at end of file
+        return item.select_score
@@ -21,58 +21,110 @@ Please note that:
 """
 import os
 import json
+import orjson
 import argparse
-from models      import Agent
-from paper_agent import PaperAgent
-from datetime    import datetime, timedelta
+from models             import Agent, RemoteAgent
+from paper_agent        import PaperAgent
+from datetime           import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
 
 # 解析命令行参数
 parser = argparse.ArgumentParser()
 parser.add_argument('--input_file',     type=str, default="data/RealScholarQuery/test.jsonl")  # 输入文件路径
 parser.add_argument('--crawler_path',   type=str, default="checkpoints/pasa-7b-crawler")        # 爬虫模型路径
 parser.add_argument('--selector_path',  type=str, default="checkpoints/pasa-7b-selector")       # 选择器模型路径
+parser.add_argument('--crawler_url',    type=str, default=None)                                  # 爬虫模型的vLLM服务地址，不指定时在本进程加载模型
+parser.add_argument('--selector_url',   type=str, default=None)                                  # 选择器模型的vLLM服务地址，不指定时在本进程加载模型
+parser.add_argument('--max_model_len',  type=int, default=None)                                  # vLLM服务的--max-model-len，提示在本地截断到该长度，默认使用分词器的最大长度
 parser.add_argument('--output_folder',  type=str, default="results")                             # 输出文件夹路径
 parser.add_argument('--expand_layers',  type=int, default=2)                                     # 扩展层数
 parser.add_argument('--search_queries', type=int, default=5)                                     # 搜索查询数量
 parser.add_argument('--search_papers',  type=int, default=10)                                    # 每个查询返回的论文数量
 parser.add_argument('--expand_papers',  type=int, default=20)                                    # 每层扩展的论文数量
 parser.add_argument('--threads_num',    type=int, default=20)                                    # 并行线程数
-args = parser.parse_args()
+parser.add_argument('--max_total_papers', type=int, default=None)                                # 每个查询最多处理的论文总数
+parser.add_argument('--prefilter_threshold', type=float, default=None)                          # 向量预筛选的余弦相似度阈值，需安装fastembed
+parser.add_argument('--resume',         action='store_true')                                     # 跳过输出文件夹中已有结果的查询，用于中断后继续运行
+parser.add_argument('--workers',        type=int, default=1)                                     # 同时处理查询的进程数，大于1时需指定vLLM服务地址
 
-# 初始化爬虫和选择器模型
-crawler = Agent(args.crawler_path)
-selector = Agent(args.selector_path)
+args, crawler, selector = None, None, None
 
-# 处理输入文件中的每个查询
-with open(args.input_file) as f:
-    for idx, line in enumerate(f.readlines()):
-        # 解析JSON数据
-        data = json.loads(line)
-        # 计算截止日期（发布时间前7天）
-        end_date = data['source_meta']['published_time']
-        end_date = datetime.strptime(end_date, "%Y%m%d") - timedelta(days=7)
-        end_date = end_date.strftime("%Y%m%d")
-        
-        # 创建PaperAgent实例
-        paper_agent = PaperAgent(
-            user_query     = data['question'], 
-            crawler        = crawler,
-            selector       = selector,
-            end_date       = end_date,
-            expand_layers  = args.expand_layers,
-            search_queries = args.expand_papers,
-            search_papers  = args.search_papers,
-            expand_papers  = args.expand_papers,
-            threads_num    = args.threads_num
-        )
-        
-        # 如果数据中包含答案，则添加到根节点的额外信息中
-        if "answer" in data:
-            paper_agent.root.extra["answer"] = data["answer"]
-        
-        # 运行PaperAgent
-        paper_agent.run()
-        
-        # 如果指定了输出文件夹，则将结果保存为JSON文件
-        if args.output_folder != "":
-            json.dump(paper_agent.root.todic(), open(os.path.join(args.output_folder, f"{idx}.json"), "w"), indent=2)
\ No newline at end of file
+def init_worker(worker_args):
+    """
+    初始化进程的命令行参数，以及爬虫和选择器模型
+    
+    参数:
+        worker_args: 解析后的命令行参数
+    """
+    global args, crawler, selector
+    args = worker_args
+    # 指定了vLLM服务地址时通过服务调用模型，多个进程共享同一份模型权重
+    crawler = RemoteAgent(args.crawler_path, args.crawler_url, max_model_len=args.max_model_len) if args.crawler_url else Agent(args.crawler_path)
+    selector = RemoteAgent(args.selector_path, args.selector_url, max_model_len=args.max_model_len) if args.selector_url else Agent(args.selector_path)
+
+def run_query(idx, line):
+    """
+    处理输入文件中的单个查询
+    
+    参数:
+        idx: 查询在输入文件中的行号，用作输出文件名
+        line: 该行的JSON字符串
+    """
+    output_file = os.path.join(args.output_folder, f"{idx}.json")
+    # 断点续跑：结果文件已存在说明该查询已完成
+    if args.resume and args.output_folder != "" and os.path.exists(output_file):
+        return
+    # 解析JSON数据
+    data = json.loads(line)
+    # 计算截止日期（发布时间前7天）
+    end_date = data['source_meta']['published_time']
+    end_date = datetime.strptime(end_date, "%Y%m%d") - timedelta(days=7)
+    end_date = end_date.strftime("%Y%m%d")
+    
+    # 创建PaperAgent实例
+    paper_agent = PaperAgent(
+        user_query     = data['question'], 
+        crawler        = crawler,
+        selector       = selector,
+        end_date       = end_date,
+        expand_layers  = args.expand_layers,
+        search_queries = args.expand_papers,
+        search_papers  = args.search_papers,
+        expand_papers  = args.expand_papers,
+        threads_num    = args.threads_num,
+        max_total_papers = args.max_total_papers,
+        prefilter_threshold = args.prefilter_threshold
+    )
+    
+    # 如果数据中包含答案，则添加到根节点的额外信息中
+    if "answer" in data:
+        paper_agent.root.extra["answer"] = data["answer"]
+    
+    # 运行PaperAgent
+    paper_agent.run()
+    
+    # 如果指定了输出文件夹，则将结果保存为JSON文件，orjson直接序列化PaperNode数据类，无需先转换为字典
+    # 先写入临时文件再重命名，中途崩溃不会留下不完整的结果文件
+    if args.output_folder != "":
+        with open(output_file + ".tmp", "wb") as out:
+            out.write(orjson.dumps(paper_agent.root, option=orjson.OPT_INDENT_2))
+        os.replace(output_file + ".tmp", output_file)
+
+if __name__ == "__main__":
+    main_args = parser.parse_args()
+    # 本地加载的模型无法在进程间共享，多进程时必须通过vLLM服务调用模型
+    if main_args.workers > 1 and not (main_args.crawler_url and main_args.selector_url):
+        parser.error("--workers > 1 requires --crawler_url and --selector_url")
+
+    # 读取输入文件中的所有查询
+    with open(main_args.input_file) as f:
+        lines = f.readlines()
+
+    if main_args.workers > 1:
+        # 各查询相互独立，由多个进程同时处理，每个进程有独立的GIL
+        with ProcessPoolExecutor(max_workers=main_args.workers, initializer=init_worker, initargs=(main_args,)) as executor:
+            list(executor.map(run_query, range(len(lines)), lines))
+    else:
+        init_worker(main_args)
+        for idx, line in enumerate(lines):
+            run_query(idx, line)
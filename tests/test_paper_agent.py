@@ -0,0 +1,110 @@
+# Copyright (c) 2024 Bytedance Ltd. and/or its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+PaperAgent的离线测试，模型和搜索函数均替换为桩函数，无需加载模型、网络或本地论文库
+
+运行: python -m unittest discover tests
+"""
+import os
+import re
+import sys
+import types
+import unittest
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 桩模块在导入paper_agent之前注册，避免导入transformers及读取data目录下的论文库
+models = types.ModuleType("models")
+models.Agent = object
+utils = types.ModuleType("utils")
+utils.cite_pattern = re.compile(r'~\\cite\{([^}]*)\}')
+utils.personalized_pagerank = lambda edges, personalization, alpha, iterations: {}
+# 搜索函数在setUp中替换
+utils.search_paper_by_title = utils.google_search_arxiv_id = utils.search_paper_by_arxiv_id = utils.search_section_by_arxiv_id = None
+sys.modules.setdefault("models", models)
+sys.modules.setdefault("utils", utils)
+
+import paper_agent
+
+BAD_TITLE = "Broken Reference 3"
+
+def fake_paper(arxiv_id, title):
+    return {
+        "arxiv_id": arxiv_id,
+        "title":    title,
+        "abstract": f"abstract of {title}",
+        "sections": {"Related Work": [f"Reference {arxiv_id} {i}" for i in range(5)] + [BAD_TITLE]},
+        "source":   "SearchFrom:stub",
+    }
+
+def fake_search_paper_by_title(title):
+    if title == BAD_TITLE:
+        raise AttributeError("'NoneType' object has no attribute 'text'")
+    return fake_paper(str(abs(hash(title)) % 10 ** 8), title)
+
+class StubCrawler:
+    def infer(self, prompt):
+        return "[Search] query one [Search] query two [StopSearch]"
+
+    def batch_infer(self, prompts):
+        return ["[Expand] Related Work [StopExpand]"] * len(prompts)
+
+class StubSelector:
+    def infer_score(self, prompts):
+        return [0.9] * len(prompts)
+
+class PaperAgentFailureTest(unittest.TestCase):
+    def setUp(self):
+        paper_agent.google_search_arxiv_id     = lambda query, num, end_date: [f"{query[-3:]}.{i}" for i in range(3)]
+        paper_agent.search_paper_by_arxiv_id   = lambda arxiv_id: fake_paper(arxiv_id, f"Paper {arxiv_id}")
+        paper_agent.search_paper_by_title      = fake_search_paper_by_title
+        paper_agent.search_section_by_arxiv_id = lambda arxiv_id, cite: None
+
+    def make_agent(self):
+        return paper_agent.PaperAgent(
+            user_query    = "stub query",
+            crawler       = StubCrawler(),
+            selector      = StubSelector(),
+            prompts_path  = os.path.join(ROOT, "agent_prompt.json"),
+            expand_layers = 2,
+            threads_num   = 4,
+        )
+
+    def test_failing_reference_lookup_is_skipped(self):
+        agent = self.make_agent()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            agent.run()
+        self.assertTrue(any("search_ref failed" in str(w.message) for w in caught))
+        # 出错的引用被跳过，其余引用照常扩展
+        self.assertNotIn(BAD_TITLE, agent.root.extra["crawler_recall_papers"])
+        self.assertGreater(sum(paper.depth == 1 for paper in agent.papers_queue), 0)
+
+    def test_failing_search_is_skipped(self):
+        def failing_search(query, num, end_date):
+            if query == "query one":
+                raise ValueError("unexpected response")
+            return ["two.0", "two.1"]
+        paper_agent.google_search_arxiv_id = failing_search
+        agent = self.make_agent()
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter("always")
+            agent.run()
+        self.assertEqual(agent.root.child["query one"], [])
+        self.assertEqual(len(agent.root.child["query two"]), 2)
+
+if __name__ == "__main__":
+    unittest.main()
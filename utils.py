@@ -26,15 +26,51 @@ import arxiv
 import urllib
 import zipfile
 import warnings
+import functools
 import requests
 from datetime   import datetime
+from diskcache  import Cache
+from urllib3.util.retry import Retry
+from requests.adapters  import HTTPAdapter
+try:
+    import re2 as cite_re  # optional linear-time regex engine: pip install google-re2
+except ImportError:
+    cite_re = re
 warnings.simplefilter("always")
 
 GOOGLE_KEY   = 'your google keys'
+CACHE_DIR    = '.pasa_cache'     # on-disk cache of search results, shared across runs and processes
+CACHE_EXPIRE = 7 * 24 * 3600     # seconds
 arxiv_client = arxiv.Client(delay_seconds = 0.05)
 id2paper     = json.load(open("data/paper_database/id2paper.json"))
 paper_db     = zipfile.ZipFile("data/paper_database/cs_paper_2nd.zip", "r")
-
+search_cache = Cache(CACHE_DIR)
+# one session for all requests so connections to google / arxiv / ar5iv are kept alive and reused across threads
+session      = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=64, pool_maxsize=64, max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])))
+arxiv_link   = re.compile(r'arxiv\.org/(?:abs|pdf|html)/(\d{4}\.\d+)')
+cite_pattern = cite_re.compile(r'~\\cite\{([^}]*)\}')  # negated class instead of a lazy .*? so no backtracking is needed
+
+def disk_memoize(make_key):
+    """
+    Cache the results of a search function on disk.
+    :param make_key: maps the call arguments to the normalized cache key
+    Empty results (None, [] or {}) are not cached since they are usually caused by network errors.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__name__,) + make_key(*args, **kwargs)
+            result = search_cache.get(key)
+            if result is None:
+                result = func(*args, **kwargs)
+                if result:
+                    search_cache.set(key, result, expire=CACHE_EXPIRE)
+            return result
+        return wrapper
+    return decorator
+
+@disk_memoize(lambda query, num=10, end_date=None: (query.strip(), num, end_date))
 def google_search_arxiv_id(query, num=10, end_date=None):
     url = "https://google.serper.dev/search"
 
@@ -60,14 +96,14 @@ def google_search_arxiv_id(query, num=10, end_date=None):
 
     for _ in range(3):
         try:
-            response = requests.request("POST", url, headers=headers, data=payload)
+            response = session.post(url, headers=headers, data=payload)
             if response.status_code == 200:
                 results = json.loads(response.text)
                 arxiv_id_list = []
                 for paper in results['organic']:
-                    if re.search(r'arxiv\.org/(?:abs|pdf|html)/(\d{4}\.\d+)', paper["link"]):
-                        arxiv_id = re.search(r'arxiv\.org/(?:abs|pdf|html)/(\d{4}\.\d+)', paper["link"]).group(1)
-                        arxiv_id_list.append(arxiv_id)
+                    match = arxiv_link.search(paper["link"])
+                    if match:
+                        arxiv_id_list.append(match.group(1))
                 return list(set(arxiv_id_list))
         except:
             warnings.warn(f"google search failed, query: {query}")
@@ -246,12 +282,15 @@ def parse_html(html_file):
     }
     return document 
 
+@disk_memoize(lambda entry_id, cite: (entry_id, getattr(cite, "pattern", cite)))
 def search_section_by_arxiv_id(entry_id, cite):
     warnings.warn("Using search_section_by_arxiv_id function may return wrong title because ar5iv parsing citation error. To solve this, You can prompt any LLM to extract the paper title from the reference string")
     assert re.match(r'^\d+\.\d+$', entry_id)
+    if isinstance(cite, str):
+        cite = re.compile(cite, re.DOTALL)
     url = f'https://ar5iv.labs.arxiv.org/html/{entry_id}'
     try:
-        response = requests.get(url)
+        response = session.get(url)
         if response.status_code == 200:
             html_content = response.text
             if not 'https://ar5iv.labs.arxiv.org/html' in html_content:
@@ -272,7 +311,7 @@ def search_section_by_arxiv_id(entry_id, cite):
                 for k, v in sections.items():
                     k = " ".join(k.split("\n"))
                     sections2title[k] = set()
-                    bibs = re.findall(cite, v, re.DOTALL)
+                    bibs = cite.findall(v)
                     for bib in bibs:
                         bib = bib.split(",")
                         for b in bib:
@@ -314,7 +353,16 @@ def search_paper_by_arxiv_id(arxiv_id):
                 "sections": data["sections"],
                 "source": 'SearchFrom:local_paper_db',
             }
+    return search_paper_by_arxiv_api(arxiv_id)
 
+@disk_memoize(lambda arxiv_id: (arxiv_id,))
+def search_paper_by_arxiv_api(arxiv_id):
+    """
+    Search paper by arxiv id with the arxiv API.
+    Only this branch is cached, papers in the local paper_db are already on disk.
+    :param arxiv_id: arxiv id of the paper
+    :return: paper list
+    """
     search = arxiv.Search(
         query = "",
         id_list = [arxiv_id],
@@ -344,6 +392,7 @@ def search_paper_by_arxiv_id(arxiv_id):
             break
     return res
     
+@disk_memoize(lambda title: (title.lower().strip(),))
 def search_arxiv_id_by_title(title):
     """
     Search arxiv id by title.
@@ -358,7 +407,7 @@ def search_arxiv_id_by_title(title):
     })
     
     try:
-        response = requests.get(url)
+        response = session.get(url)
         if response.status_code == 200:
             html_content = response.text
             soup = bs4.BeautifulSoup(html_content, 'html.parser')
@@ -470,7 +519,37 @@ def cal_micro(pred_set, label_set):
     assert len(label_set) != 0
     return tp, fp, fn
 
+def personalized_pagerank(edges, personalization, alpha=0.15, iterations=20):
+    """
+    Personalized PageRank by power iteration over a sparse edge list.
+    :param edges: iterable of (source, target) pairs, e.g. (citing paper, cited paper)
+    :param personalization: dict of node -> teleport weight, normalized internally
+    :param alpha: teleport probability
+    :param iterations: number of power iterations
+    :return: dict of node -> rank, nodes not reachable from the seeds are omitted
+    """
+    total = sum(personalization.values())
+    if total <= 0:
+        return {}
+    teleport = {k: v / total for k, v in personalization.items() if v > 0}
+    out_links = {}
+    for source, target in edges:
+        out_links.setdefault(source, []).append(target)
+
+    ranks = dict(teleport)
+    for _ in range(iterations):
+        new_ranks = {k: alpha * v for k, v in teleport.items()}
+        for source, rank in ranks.items():
+            targets = out_links.get(source)
+            if not targets:
+                continue
+            share = (1 - alpha) * rank / len(targets)
+            for target in targets:
+                new_ranks[target] = new_ranks.get(target, 0.0) + share
+        ranks = new_ranks
+    return ranks
+
 if __name__ == "__main__":
-    print(search_section_by_arxiv_id("2307.00235", r"~\\cite\{(.*?)\}"))
+    print(search_section_by_arxiv_id("2307.00235", cite_pattern))
     # print(search_paper_by_arxiv_id("2307.00235"))
     # print(search_paper_by_title("A hybrid approach to CMB lensing reconstruction on all-sky intensity maps"))
\ No newline at end of file